@@ -0,0 +1,423 @@
+"""Offline bulk deepfake scan for large media archives.
+
+Walks a directory tree, hashes and preprocesses files in parallel worker
+processes, runs batched inference in the main process and appends one JSON
+line per file to the output. The output doubles as the checkpoint: rerunning
+the same command skips files already recorded (same path, size and mtime).
+
+The scan refuses to run on the random mock predictions deepfake_detection
+falls back to when the model can't be loaded, unless --allow-mock is given;
+mock records are marked, rescanned once a model is available, and never
+committed on-chain.
+
+    python bulk_scan.py /data/archive --output scan.jsonl --workers 8
+    python bulk_scan.py /data/archive --output scan.jsonl --commit
+"""
+import os
+import sys
+import json
+import asyncio
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import deepfake_detection
+from deepfake_detection import (
+    IMAGE_EXTENSIONS,
+    VIDEO_EXTENSIONS,
+    hash_file,
+    preprocess_file,
+    detect_batch,
+    load_detection_model,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = set(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)
+WORKER_CRASHED = "worker process crashed while preprocessing"
+MAX_CONSECUTIVE_FAILURES = 5
+
+
+class MockModelError(Exception):
+    """Raised when the model is unavailable and mock verdicts weren't allowed"""
+
+
+def iter_media_files(root):
+    """Yield (path, size, mtime_ns) for supported files under root"""
+    # Absolute, symlink-free paths keep checkpoint keys stable across
+    # working directories and spellings of root
+    root = os.path.realpath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Skipping {path}: {e}")
+                continue
+            yield path, stat.st_size, stat.st_mtime_ns
+
+
+def read_jsonl(path):
+    """Read records from a JSONL file, ignoring a torn final line"""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring incomplete line in {path}")
+    return records
+
+
+def drop_torn_line(path, block_size=64 * 1024):
+    """Truncate a partial last line left by an interrupted write"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk backwards in blocks to find the last complete line
+        pos = end
+        while pos > 0:
+            start = max(0, pos - block_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+def load_checkpoint(output_path, include_mock=False):
+    """Return {path: (size, mtime_ns)} for files already scanned.
+
+    Mock records only count as done when include_mock is set, so a real
+    model run rescans them.
+    """
+    done = {}
+    for record in read_jsonl(output_path):
+        if record.get("mock") and not include_mock:
+            done.pop(record["path"], None)
+        else:
+            done[record["path"]] = (record["size"], record["mtime_ns"])
+    return done
+
+
+def hash_and_preprocess(path):
+    """Worker task: hash and preprocess a single file"""
+    try:
+        file_hash = hash_file(path)
+    except Exception as e:
+        return None, None, str(e)
+    # Keep the hash when only decoding fails so error records identify content
+    try:
+        input_data, error = preprocess_file(path)
+        return file_hash, input_data, error
+    except Exception as e:
+        return file_hash, None, str(e)
+
+
+def new_pool(workers):
+    """Process pool for hash_and_preprocess.
+
+    Spawned workers import only the preprocessing code; forking would copy
+    the model and TensorFlow state loaded in the main process into each one.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def run_isolated(path):
+    """Retry one file in its own worker after the shared pool broke.
+
+    Returns the worker result, or an error result with a hash computed in
+    this process if the file crashes the worker again.
+    """
+    with new_pool(1) as executor:
+        try:
+            return executor.submit(hash_and_preprocess, path).result()
+        except BrokenProcessPool:
+            logger.error(f"❌ Worker crashed on {path}")
+    try:
+        file_hash = hash_file(path)
+    except Exception:
+        file_hash = None
+    return file_hash, None, WORKER_CRASHED
+
+
+class ResultWriter:
+    """Append-only JSONL writer that fsyncs every `checkpoint_every` records"""
+
+    def __init__(self, path, checkpoint_every):
+        drop_torn_line(path)
+        self.file = open(path, "a")
+        self.checkpoint_every = checkpoint_every
+        self.pending = 0
+        self.written = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.pending += 1
+        self.written += 1
+        if self.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+def flush_batch(batch, writer):
+    """Run inference on a batch of preprocessed files and record results"""
+    if not batch:
+        return
+    predictions = detect_batch([item["input_data"] for item in batch])
+    mock = bool(deepfake_detection.use_mock)
+    for item, (label, confidence) in zip(batch, predictions):
+        writer.write(make_record(item["entry"], item["sha256"], label, confidence, mock=mock))
+    batch.clear()
+
+
+def make_record(entry, file_hash, label, confidence, error=None, mock=False):
+    path, size, mtime_ns = entry
+    return {
+        "path": path,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "sha256": file_hash,
+        "label": label,
+        "confidence": confidence,
+        "error": error,
+        "mock": mock,
+    }
+
+
+def scan(root, output_path, workers=None, batch_size=32, checkpoint_every=500, allow_mock=False):
+    """Scan `root`, appending results to `output_path`; returns files scanned"""
+    load_detection_model()
+    if deepfake_detection.use_mock:
+        if not allow_mock:
+            raise MockModelError(
+                f"Model could not be loaded from {deepfake_detection.MODEL_PATH}; "
+                "refusing to record mock verdicts (pass --allow-mock to override)"
+            )
+        logger.warning("⚠️ Using mock predictions; records are marked \"mock\": true")
+
+    # Drop a torn record before reading the checkpoint, or a record missing
+    # only its newline would count as done and then be truncated away
+    drop_torn_line(output_path)
+    done = load_checkpoint(output_path, include_mock=allow_mock)
+    pending = (
+        entry for entry in iter_media_files(root)
+        if done.get(entry[0]) != (entry[1], entry[2])
+    )
+    if done:
+        logger.info(f"🔁 Resuming: {len(done)} files already in {output_path}")
+
+    writer = ResultWriter(output_path, checkpoint_every)
+    batch = []
+    started = time.time()
+    # Bound in-flight work so preprocessed arrays don't pile up in memory
+    max_in_flight = max(batch_size, (workers or os.cpu_count() or 1) * 4)
+
+    def handle(entry, result):
+        file_hash, input_data, error = result
+        if error:
+            writer.write(make_record(entry, file_hash, "error", 0.0, error))
+            return
+        batch.append({"entry": entry, "sha256": file_hash, "input_data": input_data})
+        if len(batch) >= batch_size:
+            flush_batch(batch, writer)
+            elapsed = time.time() - started
+            logger.info(f"📊 {writer.written} files scanned ({writer.written / elapsed:.1f}/s)")
+
+    in_flight = {}
+    executor = new_pool(workers)
+
+    def recover(unsubmitted=()):
+        # A worker died (e.g. a decoder segfault) and took every in-flight
+        # task with it; retry those one by one so only the offending file
+        # gets an error record, then carry on with a fresh pool
+        nonlocal executor
+        suspects = list(in_flight.values()) + list(unsubmitted)
+        in_flight.clear()
+        executor.shutdown(wait=True, cancel_futures=True)
+        logger.warning(f"⚠️ Worker pool broke; retrying {len(suspects)} files individually")
+        for suspect in suspects:
+            handle(suspect, run_isolated(suspect[0]))
+        executor = new_pool(workers)
+
+    try:
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                entry = next(pending, None)
+                if entry is None:
+                    exhausted = True
+                    break
+                try:
+                    in_flight[executor.submit(hash_and_preprocess, entry[0])] = entry
+                except BrokenProcessPool:
+                    recover([entry])
+
+            if not in_flight:
+                continue
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    recover()
+                    break
+                handle(in_flight.pop(future), result)
+        flush_batch(batch, writer)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+
+    logger.info(f"✅ Scan complete: {writer.written} new results in {output_path}")
+    return writer.written
+
+
+def store_with_retry(store_result_sync, felt_hash, prediction, max_retries=3):
+    """Retry Starknet transactions with backoff"""
+    for attempt in range(max_retries):
+        try:
+            tx_hash = store_result_sync(None, felt_hash, prediction)
+            if tx_hash:
+                return tx_hash
+        except Exception as e:
+            logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
+        if attempt < max_retries - 1:
+            time.sleep(2 ** attempt)
+    return None
+
+
+def connect_starknet():
+    """Initialise Starknet once and return its sync store function"""
+    # Imported here so offline scans don't need Starknet credentials
+    from starknet_utils import init_starknet, store_result_sync
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(init_starknet())
+    finally:
+        loop.close()
+    return store_result_sync
+
+
+def commit_results(output_path, commits_path, store_result_sync=None,
+                   max_consecutive_failures=MAX_CONSECUTIVE_FAILURES):
+    """Store scanned verdicts on Starknet, skipping hashes already committed.
+
+    Returns the number of queued verdicts left uncommitted. Stops early if
+    Starknet can't be initialised or too many commits fail in a row.
+    """
+    drop_torn_line(commits_path)
+    committed = {record["sha256"] for record in read_jsonl(commits_path)}
+
+    # Latest record per path wins, so rescanned files replace older verdicts
+    latest = {record["path"]: record for record in read_jsonl(output_path)}
+    verdicts = {}
+    mock_count = 0
+    for record in latest.values():
+        if record.get("mock"):
+            mock_count += 1
+        elif record["label"] in ("real", "fake"):
+            verdicts[record["sha256"]] = 1 if record["label"] == "fake" else 0
+    if mock_count:
+        logger.warning(f"⚠️ Refusing to commit {mock_count} mock verdicts; rescan them with a real model")
+
+    queue = [(h, p) for h, p in verdicts.items() if h not in committed]
+    logger.info(f"⛓️ {len(queue)} verdicts queued for commitment ({len(committed)} already stored)")
+    if not queue:
+        return 0
+
+    if store_result_sync is None:
+        try:
+            store_result_sync = connect_starknet()
+        except Exception as e:
+            logger.critical(f"❌ Starknet initialisation failed, nothing committed: {e}")
+            return len(queue)
+
+    failed = consecutive = 0
+    with open(commits_path, "a") as f:
+        for index, (file_hash, prediction) in enumerate(queue):
+            felt_hash = int(file_hash[:62], 16)  # first 31 bytes, as in app.py
+            tx_hash = store_with_retry(store_result_sync, felt_hash, prediction)
+            if not tx_hash:
+                logger.error(f"❌ Commit failed for {file_hash}: max retries reached")
+                failed += 1
+                consecutive += 1
+                if consecutive >= max_consecutive_failures:
+                    remaining = len(queue) - index - 1
+                    logger.critical(f"❌ {consecutive} commits failed in a row; stopping with {remaining} verdicts not attempted")
+                    return failed + remaining
+                continue
+            consecutive = 0
+            f.write(json.dumps({
+                "sha256": file_hash,
+                "felt_hash": f"0x{felt_hash:x}",
+                "prediction": prediction,
+                "tx_hash": tx_hash,
+            }) + "\n")
+            # Each line stands for an irreversible transaction
+            f.flush()
+            os.fsync(f.fileno())
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk deepfake scan of a media directory")
+    parser.add_argument("root", help="Directory to scan recursively")
+    parser.add_argument("--output", default="scan_results.jsonl", help="JSONL results file (also the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=None, help="Hash/preprocess processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Files per model.predict call")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="fsync the output every N results")
+    parser.add_argument("--allow-mock", action="store_true", help="Record random mock verdicts if the model can't be loaded (testing only)")
+    parser.add_argument("--commit", action="store_true", help="Store verdicts on Starknet after scanning")
+    parser.add_argument("--commits-file", default=None, help="JSONL log of committed verdicts (default: <output>.commits.jsonl)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+
+    try:
+        scan(args.root, args.output, args.workers, args.batch_size,
+             args.checkpoint_every, args.allow_mock)
+    except MockModelError as e:
+        logger.critical(f"❌ {e}")
+        return 1
+
+    if args.commit:
+        commits_path = args.commits_file or f"{os.path.splitext(args.output)[0]}.commits.jsonl"
+        failed = commit_results(args.output, commits_path)
+        if failed:
+            logger.error(f"❌ {failed} verdicts were not committed; rerun with --commit to retry them")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,28 +3,45 @@ import random
 import numpy as np
 import cv2
 import hashlib
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import img_to_array, load_img
-
-# Try loading model, fallback to mock
-try:
-    model = load_model('models/model.h5')
-    use_mock = False
-except Exception as e:
-    print(f"⚠️ Model load failed, using mock predictions. Error: {e}")
-    use_mock = True
+from PIL import Image
 
+MODEL_PATH = 'models/model.h5'
 TARGET_SIZE = (224, 224)
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi']
+
+# Loaded on first prediction, and TensorFlow imported only then, so
+# preprocessing-only callers (e.g. the bulk scanner's worker processes)
+# stay light
+model = None
+use_mock = None
 
-def hash_file(file_path):
+def load_detection_model():
+    """Load the model once, falling back to mock predictions"""
+    global model, use_mock
+    if use_mock is None:
+        try:
+            from tensorflow.keras.models import load_model
+            model = load_model(MODEL_PATH)
+            use_mock = False
+        except Exception as e:
+            print(f"⚠️ Model load failed, using mock predictions. Error: {e}")
+            use_mock = True
+    return model
+
+def hash_file(file_path, chunk_size=1024 * 1024):
     """Generate SHA-256 hash of file content"""
+    sha256 = hashlib.sha256()
     with open(file_path, "rb") as f:
-        file_data = f.read()
-        return hashlib.sha256(file_data).hexdigest()
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
 def preprocess_image(img_path, target_size=TARGET_SIZE):
-    img = load_img(img_path, target_size=target_size)
-    img_array = img_to_array(img) / 255.0
+    # Same as keras load_img: RGB, nearest-neighbour resize to (height, width)
+    with Image.open(img_path) as img:
+        img = img.convert("RGB").resize((target_size[1], target_size[0]), Image.NEAREST)
+        img_array = np.asarray(img, dtype="float32") / 255.0
     return np.expand_dims(img_array, axis=0)
 
 def preprocess_video(video_path, target_size=TARGET_SIZE, max_frames=10):
@@ -44,20 +61,57 @@ def preprocess_video(video_path, target_size=TARGET_SIZE, max_frames=10):
     cap.release()
     return np.array(frames) if frames else None
 
-def detect_deepfake(file_path):
+def preprocess_file(file_path):
+    """Return (input_data, error) for a supported image or video"""
     ext = os.path.splitext(file_path)[1].lower()
-    file_hash = hash_file(file_path)
 
-    if ext in ['.jpg', '.jpeg', '.png']:
-        input_data = preprocess_image(file_path)
-    elif ext in ['.mp4', '.mov', '.avi']:
+    if ext in IMAGE_EXTENSIONS:
+        return preprocess_image(file_path), None
+    elif ext in VIDEO_EXTENSIONS:
         input_data = preprocess_video(file_path)
         if input_data is None:
-            return "error", 0.0, file_hash
+            return None, "error"
+        return input_data, None
     else:
-        return "unsupported file type", 0.0, file_hash
+        return None, "unsupported file type"
+
+def detect_batch(inputs):
+    """Classify several preprocessed inputs with a single model call.
+
+    Each input is an image (1 frame) or video (n frames) array; frames are
+    stacked, predicted together and averaged back per input, matching
+    detect_deepfake. Returns a list of (label, confidence).
+    """
+    load_detection_model()
+    if not inputs:
+        return []
+
+    if use_mock:
+        return [
+            (random.choice(["real", "fake"]), round(random.uniform(0.65, 0.98), 2))
+            for _ in inputs
+        ]
+
+    predictions = model.predict(np.concatenate(inputs, axis=0))
+    results = []
+    offset = 0
+    for input_data in inputs:
+        frames = len(input_data)
+        conf = float(np.mean(predictions[offset:offset + frames, 0]))
+        offset += frames
+        label = "fake" if conf > 0.5 else "real"
+        results.append((label, conf))
+    return results
+
+def detect_deepfake(file_path):
+    file_hash = hash_file(file_path)
+
+    input_data, error = preprocess_file(file_path)
+    if error:
+        return error, 0.0, file_hash
 
     # Use mock if model isn't available
+    load_detection_model()
     if use_mock:
         label = random.choice(["real", "fake"])
         confidence = round(random.uniform(0.65, 0.98), 2)
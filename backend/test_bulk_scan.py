@@ -0,0 +1,327 @@
+"""Checkpoint/resume, mock-guard and commit tests for bulk_scan.
+
+Most tests stub hashing, preprocessing and inference and run the worker
+pool on threads; the process pool tests use real spawned workers with the
+real hashing and preprocessing. Inference is always stubbed, so none of
+these need TensorFlow or a model file.
+
+    cd backend && python -m pytest -q test_bulk_scan.py
+"""
+import os
+import json
+import hashlib
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import bulk_scan
+import deepfake_detection
+
+
+def stub_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def stub_preprocess(path):
+    with open(path, "rb") as f:
+        if b"bad" in f.read():
+            return None, "error"
+    return np.zeros((1, 2, 2, 3)), None
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    """Stub the detection pipeline and run the worker pool on threads"""
+    monkeypatch.setattr(bulk_scan, "hash_file", stub_hash)
+    monkeypatch.setattr(bulk_scan, "preprocess_file", stub_preprocess)
+    monkeypatch.setattr(bulk_scan, "detect_batch", lambda inputs: [("fake", 0.9) for _ in inputs])
+    monkeypatch.setattr(bulk_scan, "load_detection_model", lambda: None)
+    monkeypatch.setattr(deepfake_detection, "use_mock", False)
+    monkeypatch.setattr(
+        bulk_scan, "ProcessPoolExecutor",
+        lambda max_workers=None, mp_context=None: ThreadPoolExecutor(max_workers or 2),
+    )
+
+
+def crashing_worker(path):
+    """Worker task that kills its process on files named crash.*"""
+    if os.path.basename(path).startswith("crash"):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return bulk_scan.hash_and_preprocess(path)
+
+
+@pytest.fixture
+def real_pool(monkeypatch):
+    """Real spawned workers and preprocessing; only inference is stubbed"""
+    monkeypatch.setattr(bulk_scan, "detect_batch", lambda inputs: [("real", 0.1) for _ in inputs])
+    monkeypatch.setattr(bulk_scan, "load_detection_model", lambda: None)
+    monkeypatch.setattr(deepfake_detection, "use_mock", False)
+
+
+@pytest.fixture
+def image_archive(tmp_path):
+    root = tmp_path / "images"
+    root.mkdir()
+    for i in range(4):
+        Image.new("RGB", (8, 8), (i * 60, 0, 0)).save(root / f"{i}.jpg")
+    (root / "corrupt.jpg").write_bytes(b"not a jpeg")
+    return root
+
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / "archive"
+    (root / "sub").mkdir(parents=True)
+    for i in range(5):
+        (root / f"{i}.jpg").write_bytes(f"image {i}".encode())
+    (root / "sub" / "clip.mp4").write_bytes(b"bad video")
+    (root / "notes.txt").write_bytes(b"ignored")
+    return root
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def read_jsonl_or_empty(path):
+    return read_records(path) if os.path.exists(path) else []
+
+
+def test_scan_records_results_and_errors(scanner, archive, tmp_path):
+    output = tmp_path / "scan.jsonl"
+    assert bulk_scan.scan(str(archive), str(output), batch_size=2) == 6
+
+    records = {os.path.basename(r["path"]): r for r in read_records(output)}
+    assert set(records) == {"0.jpg", "1.jpg", "2.jpg", "3.jpg", "4.jpg", "clip.mp4"}
+    assert records["0.jpg"]["label"] == "fake"
+    assert records["0.jpg"]["sha256"] == stub_hash(archive / "0.jpg")
+    assert records["0.jpg"]["mock"] is False
+    assert records["clip.mp4"]["label"] == "error"
+    assert records["clip.mp4"]["error"] == "error"
+    assert all(os.path.isabs(r["path"]) for r in records.values())
+
+
+def test_resume_skips_unchanged_and_rescans_modified(scanner, archive, tmp_path):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+
+    assert bulk_scan.scan(str(archive), str(output)) == 0
+
+    (archive / "1.jpg").write_bytes(b"edited image, different size")
+    stat = os.stat(archive / "2.jpg")
+    os.utime(archive / "2.jpg", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert bulk_scan.scan(str(archive), str(output)) == 2
+
+    rescanned = [os.path.basename(r["path"]) for r in read_records(output)[6:]]
+    assert sorted(rescanned) == ["1.jpg", "2.jpg"]
+
+
+def test_resume_matches_relative_and_absolute_roots(scanner, archive, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+
+    monkeypatch.chdir(tmp_path)
+    assert bulk_scan.scan("./archive", str(output)) == 0
+    monkeypatch.chdir(archive / "sub")
+    assert bulk_scan.scan("..", str(output)) == 0
+
+
+def test_resume_after_torn_line(scanner, archive, tmp_path):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+    data = output.read_bytes()
+    output.write_bytes(data[:-20])
+
+    assert bulk_scan.scan(str(archive), str(output)) == 1
+    records = read_records(output)
+    assert len(records) == 6
+    assert len({r["path"] for r in records}) == 6
+
+
+def test_resume_rescans_record_missing_only_its_newline(scanner, archive, tmp_path):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+    last = read_records(output)[-1]["path"]
+    output.write_bytes(output.read_bytes()[:-1])
+
+    assert bulk_scan.scan(str(archive), str(output)) == 1
+    records = read_records(output)
+    assert len(records) == 6
+    assert records[-1]["path"] == last
+
+
+def test_error_record_keeps_hash_when_preprocessing_raises(scanner, archive, tmp_path, monkeypatch):
+    def raising_preprocess(path):
+        raise ValueError("cannot decode")
+
+    monkeypatch.setattr(bulk_scan, "preprocess_file", raising_preprocess)
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+
+    for record in read_records(output):
+        assert record["label"] == "error"
+        assert record["error"] == "cannot decode"
+        assert record["sha256"] == stub_hash(record["path"])
+
+
+def test_drop_torn_line_across_blocks(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_bytes(b'{"a": 1}\n' + b"x" * 100)
+    bulk_scan.drop_torn_line(str(path), block_size=8)
+    assert path.read_bytes() == b'{"a": 1}\n'
+
+    path.write_bytes(b"x" * 50)
+    bulk_scan.drop_torn_line(str(path), block_size=8)
+    assert path.read_bytes() == b""
+
+
+def test_scan_refuses_mock_model(scanner, archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(deepfake_detection, "use_mock", True)
+    output = tmp_path / "scan.jsonl"
+
+    with pytest.raises(bulk_scan.MockModelError, match="--allow-mock"):
+        bulk_scan.scan(str(archive), str(output))
+    assert not output.exists()
+
+
+def test_mock_records_are_marked_and_rescanned(scanner, archive, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    monkeypatch.setattr(deepfake_detection, "use_mock", True)
+    bulk_scan.scan(str(archive), str(output), allow_mock=True)
+    assert all(r["mock"] for r in read_records(output) if r["label"] != "error")
+
+    monkeypatch.setattr(deepfake_detection, "use_mock", False)
+    assert bulk_scan.scan(str(archive), str(output)) == 5
+
+
+def test_commit_skips_mock_and_committed_and_retries(scanner, archive, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    commits = tmp_path / "scan.commits.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+    verdicts = [r for r in read_records(output) if r["label"] == "fake"]
+    with open(output, "a") as f:
+        extra = dict(verdicts[0], path="/elsewhere/mock.jpg", sha256="ab" * 32, mock=True)
+        f.write(json.dumps(extra) + "\n")
+
+    first = verdicts[0]["sha256"]
+    commits.write_bytes(json.dumps({"sha256": first}).encode() + b'\n{"sha256": "tor')
+
+    calls = []
+
+    def flaky_store(contract, felt_hash, prediction):
+        calls.append(felt_hash)
+        if len(calls) == 1:
+            raise ConnectionError("rpc hiccup")
+        return hex(felt_hash)
+
+    monkeypatch.setattr(bulk_scan.time, "sleep", lambda seconds: None)
+    assert bulk_scan.commit_results(str(output), str(commits), store_result_sync=flaky_store) == 0
+
+    committed = read_records(commits)
+    hashes = [r["sha256"] for r in committed]
+    assert len(hashes) == len(set(hashes)) == 5
+    assert "ab" * 32 not in hashes
+    assert len(calls) == 5  # 4 new verdicts plus one retry
+    assert all(r["prediction"] == 1 for r in committed[1:])
+
+
+def test_detect_batch_splits_predictions_per_input(monkeypatch):
+    class StubModel:
+        def predict(self, frames):
+            # One score per frame, encoded in the first pixel
+            return frames[:, 0, 0, :1]
+
+    monkeypatch.setattr(deepfake_detection, "model", StubModel())
+    monkeypatch.setattr(deepfake_detection, "use_mock", False)
+
+    image = np.full((1, 2, 2, 3), 0.8)
+    video = np.stack([np.full((2, 2, 3), v) for v in (0.1, 0.2, 0.3)])
+    single_frame_video = np.full((1, 2, 2, 3), 0.6)
+
+    results = deepfake_detection.detect_batch([image, video, single_frame_video])
+
+    assert [label for label, _ in results] == ["fake", "real", "fake"]
+    assert [conf for _, conf in results] == pytest.approx([0.8, 0.2, 0.6])
+
+
+def test_store_with_retry_does_not_sleep_after_last_attempt(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(bulk_scan.time, "sleep", sleeps.append)
+
+    def failing_store(contract, felt_hash, prediction):
+        raise ConnectionError("down")
+
+    assert bulk_scan.store_with_retry(failing_store, 1, 0) is None
+    assert sleeps == [1, 2]
+
+
+def test_commit_aborts_when_starknet_cannot_initialise(scanner, archive, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+
+    def broken_connect():
+        raise TypeError("ACCOUNT_ADDRESS is not set")
+
+    monkeypatch.setattr(bulk_scan, "connect_starknet", broken_connect)
+    assert bulk_scan.commit_results(str(output), str(tmp_path / "commits.jsonl")) == 5
+    assert not read_jsonl_or_empty(tmp_path / "commits.jsonl")
+
+
+def test_commit_stops_after_consecutive_failures(scanner, archive, tmp_path, monkeypatch):
+    output = tmp_path / "scan.jsonl"
+    bulk_scan.scan(str(archive), str(output))
+    monkeypatch.setattr(bulk_scan.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def failing_store(contract, felt_hash, prediction):
+        calls.append(felt_hash)
+        raise ConnectionError("down")
+
+    left = bulk_scan.commit_results(
+        str(output), str(tmp_path / "commits.jsonl"),
+        store_result_sync=failing_store, max_consecutive_failures=2,
+    )
+    assert left == 5
+    assert len(calls) == 2 * 3
+
+
+def test_main_exits_non_zero_when_commits_fail(scanner, archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_scan, "commit_results", lambda output, commits: 3)
+    output = tmp_path / "scan.jsonl"
+
+    assert bulk_scan.main([str(archive), "--output", str(output), "--commit"]) == 1
+    assert bulk_scan.main([str(archive), "--output", str(output)]) == 0
+
+
+def test_process_pool_scan_and_resume(real_pool, image_archive, tmp_path):
+    output = tmp_path / "scan.jsonl"
+    assert bulk_scan.scan(str(image_archive), str(output), workers=2, batch_size=2) == 5
+
+    records = {os.path.basename(r["path"]): r for r in read_records(output)}
+    assert all(records[f"{i}.jpg"]["label"] == "real" for i in range(4))
+    assert records["corrupt.jpg"]["label"] == "error"
+    assert records["corrupt.jpg"]["sha256"] == stub_hash(image_archive / "corrupt.jpg")
+
+    assert bulk_scan.scan(str(image_archive), str(output), workers=2) == 0
+
+
+def test_process_pool_survives_worker_crash(real_pool, image_archive, tmp_path, monkeypatch):
+    (image_archive / "crash.mp4").write_bytes(b"segfaults the decoder")
+    monkeypatch.setattr(bulk_scan, "hash_and_preprocess", crashing_worker)
+    output = tmp_path / "scan.jsonl"
+
+    assert bulk_scan.scan(str(image_archive), str(output), workers=2) == 6
+
+    records = {os.path.basename(r["path"]): r for r in read_records(output)}
+    assert len(records) == 6
+    assert records["crash.mp4"]["error"] == bulk_scan.WORKER_CRASHED
+    assert records["crash.mp4"]["sha256"] == stub_hash(image_archive / "crash.mp4")
+    assert all(records[f"{i}.jpg"]["label"] == "real" for i in range(4))
+
+    # The crash is recorded, so a rerun doesn't resubmit the file
+    assert bulk_scan.scan(str(image_archive), str(output), workers=2) == 0